@@ -1,16 +1,23 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-import folium
-from folium.features import GeoJsonTooltip
+import pydeck as pdk
 import branca.colormap as cm
-from streamlit_folium import st_folium
+import hashlib
 import tempfile
 import os
-import zipfile
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 EXCEL_FILE = "factors.xlsx"
+TRACTS_ASSET = "jefferson_tracts.fgb"  # built offline by prepare_tracts.py
+CACHE_DIR = ".cache"
+
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1,
+                                       max_retries=Retry(total=3, backoff_factor=0.3)))
 SHEETS_TO_USE = [
     "DemographicFactorData",
     "ClinicalFactorData",
@@ -22,64 +29,227 @@ SHEETS_TO_USE = [
     "ExposureToNature"
 ]
 
+def _simplify_tracts(gdf):
+    # ~50m tolerance: invisible at zoom 11 but sheds most TIGER vertices.
+    # topojson simplifies shared borders once, so adjacent tracts keep
+    # matching edges; fall back to plain shapely simplify without it.
+    try:
+        import topojson as tp
+        return tp.Topology(gdf, prequantize=True).toposimplify(0.0005).to_gdf(crs=gdf.crs)
+    except ImportError:
+        gdf["geometry"] = gdf.geometry.simplify(tolerance=0.0005, preserve_topology=True)
+        return gdf
+
+def _factors_cache_dir():
+    mtime = int(os.path.getmtime(EXCEL_FILE))
+    return os.path.join(CACHE_DIR, "factors", str(mtime))
+
 @st.cache_data
 def load_excel_sheets():
     sheet_dfs = {}
-    for sheet in SHEETS_TO_USE:
+
+    # The marker file is written only after every sheet serialized, so a
+    # partially-populated dir from an interrupted write is never served.
+    cache_dir = _factors_cache_dir()
+    if os.path.exists(os.path.join(cache_dir, "_complete")):
+        for sheet in SHEETS_TO_USE:
+            path = os.path.join(cache_dir, f"{sheet}.parquet")
+            if os.path.exists(path):
+                sheet_dfs[sheet] = pd.read_parquet(path)
+        if sheet_dfs:
+            return sheet_dfs
+
+    try:
+        all_sheets = pd.read_excel(EXCEL_FILE, sheet_name=SHEETS_TO_USE, engine="calamine")
+    except Exception as e:
+        st.error(f"Could not read '{EXCEL_FILE}': {e}")
+        return sheet_dfs
+
+    for sheet, df in all_sheets.items():
         try:
             if sheet == "DemographicFactorData":
-                df = pd.read_excel(EXCEL_FILE, sheet_name=sheet, skiprows=1, nrows=215)
-            else:
-                df = pd.read_excel(EXCEL_FILE, sheet_name=sheet)
+                # Header sits on the second row of this sheet only.
+                df = pd.read_excel(EXCEL_FILE, sheet_name=sheet, skiprows=1, nrows=215, engine="calamine")
 
             df.columns = df.columns.str.strip().str.lower().str.replace(" ", "")
             if "tractid" in df.columns:
-                df["tractid"] = df["tractid"].astype(str).str.replace("1400000US", "", regex=False).str.strip()
+                df["tractid"] = df["tractid"].astype(str).str.removeprefix("1400000US").str.strip()
+                # Mixed-type object columns (ints with '-' placeholders)
+                # break Arrow serialization and hide the column from the
+                # numeric feature matrix; coerce them one way or the other.
+                for col in df.columns:
+                    if col != "tractid" and df[col].dtype == object:
+                        numeric = pd.to_numeric(df[col], errors="coerce")
+                        df[col] = numeric if numeric.notna().any() else df[col].astype(str)
                 sheet_dfs[sheet] = df
             else:
                 st.warning(f"Sheet **{sheet}** is missing a 'tractid' column. Skipped.")
         except Exception as e:
             st.warning(f"Could not load sheet '{sheet}': {e}")
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except Exception as e:
+        st.warning(f"Could not write Parquet cache: {e}")
+        return sheet_dfs
+
+    cache_ok = True
+    for sheet, df in sheet_dfs.items():
+        try:
+            df.to_parquet(os.path.join(cache_dir, f"{sheet}.parquet"), compression="zstd")
+        except Exception as e:
+            cache_ok = False
+            st.warning(f"Could not cache sheet '{sheet}': {e}")
+    if cache_ok:
+        open(os.path.join(cache_dir, "_complete"), "w").close()
+
     return sheet_dfs
 
 @st.cache_data
 def load_tracts():
+    if os.path.exists(TRACTS_ASSET):
+        gdf = gpd.read_file(TRACTS_ASSET)
+        gdf["tractid_short"] = gdf["GEOID"]
+        return gdf
+
+    cache_path = os.path.join(CACHE_DIR, "tracts_jefferson.parquet")
+    if os.path.exists(cache_path):
+        return gpd.read_parquet(cache_path)
+
     url = "https://www2.census.gov/geo/tiger/TIGER2022/TRACT/tl_2022_21_tract.zip"
     with tempfile.TemporaryDirectory() as tmpdir:
         zip_path = os.path.join(tmpdir, "tracts.zip")
-        shp_path = None
 
         try:
-            response = requests.get(url, verify=False, timeout=30)
-            with open(zip_path, "wb") as f:
-                f.write(response.content)
-
-            with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                zip_ref.extractall(tmpdir)
-                for f in zip_ref.namelist():
-                    if f.endswith(".shp"):
-                        shp_path = os.path.join(tmpdir, f)
+            with _SESSION.get(url, timeout=(5, 30), stream=True) as response:
+                response.raise_for_status()
+                with open(zip_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=1 << 16):
+                        f.write(chunk)
 
-            gdf = gpd.read_file(shp_path)
+            # GDAL reads the shapefile out of the ZIP directly; no extraction.
+            gdf = gpd.read_file(f"zip://{zip_path}!tl_2022_21_tract.shp")
             gdf = gdf[gdf["COUNTYFP"] == "111"]  # Jefferson County
             gdf["tractid_short"] = gdf["GEOID"]
-            return gdf.to_crs(epsg=4326)
+            gdf = gdf.to_crs(epsg=4326)
+            gdf = _simplify_tracts(gdf)
+
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                gdf.to_parquet(cache_path)
+            except Exception as e:
+                st.warning(f"Could not write tract cache: {e}")
+            return gdf
         except Exception as e:
             st.error(f"Failed to load tract shapefile: {e}")
             return gpd.GeoDataFrame()
 
-def calculate_weighted_risk_index(df, weights):
-    df_clean = df.copy()
-    valid_cols = [col for col in weights if col in df_clean.columns and weights[col] > 0]
-    if not valid_cols:
-        st.warning("No valid columns selected or all weights are zero.")
-        df_clean["risk_index"] = None
-        return df_clean
+@st.cache_data
+def build_feature_matrix(sheet_dfs, tract_ids):
+    """Align every numeric factor column to the tract universe once.
+
+    Returns (column_names, sheet_of_col, matrix) where matrix is
+    tracts x columns; per-rerun risk computation is then a single matvec
+    over a column slice instead of a fresh merge.
+    """
+    # Categorical tract ids let the per-sheet reindex compare integer
+    # codes instead of hashing ~200 strings eight times over.
+    tract_dtype = pd.CategoricalDtype(categories=tract_ids)
+    index = pd.CategoricalIndex(tract_ids, dtype=tract_dtype)
+    column_names = []
+    sheet_of_col = []
+    aligned_frames = []
+    seen_cols = set()
+
+    for sheet, df in sheet_dfs.items():
+        if "tractid" not in df.columns:
+            continue
+        # Ids outside the tract universe (malformed sheets stringify them
+        # with a trailing ".0") must be NaN-ed explicitly; casting them
+        # into the categorical is deprecated and raises under pandas 4.
+        ids = df["tractid"].where(df["tractid"].isin(tract_ids))
+        df = df.set_index(ids.astype(tract_dtype)).drop(columns=["tractid"])
+        df = df.loc[~df.index.duplicated(keep="first")]
+        df = df.select_dtypes(include="number")
+        df = df.reindex(index)
+        df.columns = [col if col not in seen_cols else f"{col}_{sheet.lower()}" for col in df.columns]
+        seen_cols.update(df.columns)
+        column_names.extend(df.columns)
+        sheet_of_col.extend(sheet for _ in df.columns)
+        aligned_frames.append(df)
+
+    if not aligned_frames:
+        return [], [], np.empty((len(index), 0), dtype=np.float32)
+
+    # float32 halves memory traffic on the matvec; display precision is
+    # nowhere near 7 significant digits anyway.
+    matrix = pd.concat(aligned_frames, axis=1).to_numpy(dtype=np.float32, na_value=np.nan)
+    return column_names, sheet_of_col, matrix
+
+@st.cache_resource
+def tract_features(_gdf_tracts):
+    """GeoJSON feature skeletons, built once and shared across sessions.
+
+    Walking shapely geometries through __geo_interface__ is the slow part
+    of serializing the map layer; only the properties change between
+    renders. The returned dicts are cache_resource-shared, so callers
+    must treat them as read-only and copy before attaching per-render
+    properties (see build_map).
+    """
+    return [
+        {
+            "type": "Feature",
+            "geometry": geom.__geo_interface__,
+            "properties": {"tractid_short": tract_id},
+        }
+        for tract_id, geom in zip(_gdf_tracts["tractid_short"], _gdf_tracts.geometry)
+    ]
+
+@st.cache_resource
+def build_map(_features, _risk, risk_key):
+    """Build the deck.gl map for one set of risk values.
 
-    weighted_sum = sum(df_clean[col] * weights[col] for col in valid_cols)
-    total_weight = sum(weights[col] for col in valid_cols)
-    df_clean["risk_index"] = weighted_sum / total_weight
-    return df_clean
+    Feature dicts and arrays aren't hashable, so the caller passes a
+    digest of the risk array as the cache key; the geometry is the same
+    every run. Each deck gets its own feature/property dicts — cached
+    decks hold their features by reference, and the skeletons are shared
+    across sessions, so mutating them in place would rewrite every
+    previously built map. Only the geometry dicts are shared, read-only.
+    Polygons are filled on the GPU via a GeoJsonLayer, so the browser no
+    longer rasterizes 200 SVG paths per pan/zoom.
+    """
+    vmin = np.nanmin(_risk)
+    vmax = np.nanmax(_risk)
+    colormap = cm.LinearColormap(['green', 'yellow', 'red'], vmin=vmin, vmax=vmax)
+
+    features = []
+    for feat, val in zip(_features, _risk):
+        props = dict(feat["properties"])
+        if np.isnan(val):
+            props["risk_index"] = None
+            props["fillColorRGBA"] = [128, 128, 128, 180]
+        else:
+            props["risk_index"] = round(float(val), 3)
+            hex_color = colormap(val).lstrip("#")
+            props["fillColorRGBA"] = [int(hex_color[i:i + 2], 16) for i in (0, 2, 4)] + [180]
+        features.append({"type": "Feature", "geometry": feat["geometry"], "properties": props})
+
+    layer = pdk.Layer(
+        "GeoJsonLayer",
+        data={"type": "FeatureCollection", "features": features},
+        get_fill_color="properties.fillColorRGBA",
+        get_line_color=[0, 0, 0],
+        line_width_min_pixels=1,
+        pickable=True,
+    )
+    return pdk.Deck(
+        layers=[layer],
+        initial_view_state=pdk.ViewState(latitude=38.25, longitude=-85.75, zoom=10),
+        # Streamlit's tooltip substitution only does exact key lookup
+        # (falling through to object.properties); dotted paths stay literal.
+        tooltip={"html": "<b>Tract ID:</b> {tractid_short}<br/><b>Loneliness Risk Index:</b> {risk_index}"},
+        map_style="light",
+    )
 
 def main():
     st.set_page_config(layout="wide")
@@ -90,65 +260,57 @@ def main():
     if gdf_tracts.empty:
         return
 
+    tract_ids = tuple(gdf_tracts["tractid_short"])
+    column_names, sheet_of_col, matrix = build_feature_matrix(sheet_dfs, tract_ids)
+
     st.sidebar.header("Step 1: Choose Data")
     selected_sheets = st.sidebar.multiselect("Sheets to Include", list(sheet_dfs.keys()), default=list(sheet_dfs.keys()))
 
     st.sidebar.header("Step 2: Select Columns & Assign Weights")
-    selected_cols = []
     weights = {}
 
-    for sheet in selected_sheets:
-        df = sheet_dfs[sheet]
-        st.sidebar.markdown(f"**{sheet}**")
-        for col in df.columns:
-            if col in ["tractid", "tractid_short"]:
+    # Form defers the rerun until "Update map", so ticking boxes and
+    # dragging sliders doesn't recompute the map per interaction.
+    with st.sidebar.form("weights_form"):
+        current_sheet = None
+        for sheet, col in zip(sheet_of_col, column_names):
+            if sheet not in selected_sheets:
                 continue
+            if sheet != current_sheet:
+                st.markdown(f"**{sheet}**")
+                current_sheet = sheet
             col_id = f"{sheet}::{col}"
-            if st.sidebar.checkbox(f"➤ {col}", key=f"check_{col_id}"):
-                selected_cols.append((sheet, col))
-                weights[col] = st.sidebar.slider(f"Weight for {col}", 0.0, 10.0, 1.0, 0.5, key=f"weight_{col_id}")
+            # The slider renders unconditionally: inside a form, widgets
+            # added by a checkbox would only appear after the next submit.
+            checked = st.checkbox(f"➤ {col}", key=f"check_{col_id}")
+            weight = st.slider(f"Weight for {col}", 0.0, 10.0, 1.0, 0.5, key=f"weight_{col_id}")
+            if checked:
+                weights[col] = weight
+        st.form_submit_button("Update map")
 
-    base_df = gdf_tracts[["tractid_short", "geometry"]].copy()
-    merged_df = base_df.copy()
+    if weights:
+        selected_idx = [i for i, col in enumerate(column_names) if weights.get(col, 0) > 0]
+        if not selected_idx:
+            st.warning("No valid columns selected or all weights are zero.")
+            return
 
-    for sheet in selected_sheets:
-        df = sheet_dfs[sheet]
-        if "tractid" not in df.columns:
-            continue
-        merged_df = merged_df.merge(df, left_on="tractid_short", right_on="tractid", how="left", suffixes=("", f"_{sheet.lower()}"))
+        w = np.fromiter((weights[column_names[i]] for i in selected_idx), dtype=np.float32)
+        risk = (matrix[:, selected_idx] @ w) / w.sum()
 
-    if weights:
-        merged_df = calculate_weighted_risk_index(merged_df, weights)
-
-        m = folium.Map(location=[38.25, -85.75], zoom_start=11, width="100%", height="100%")
-
-        if merged_df["risk_index"].notnull().any():
-            vmin = merged_df["risk_index"].min()
-            vmax = merged_df["risk_index"].max()
-            colormap = cm.LinearColormap(['green', 'yellow', 'red'], vmin=vmin, vmax=vmax, caption='Loneliness Risk Index')
-            colormap.add_to(m)
-
-            folium.GeoJson(
-                merged_df,
-                style_function=lambda feature: {
-                    'fillColor': colormap(feature['properties'].get("risk_index", 0)) if feature['properties'].get("risk_index") is not None else 'gray',
-                    'color': 'black',
-                    'weight': 0.5,
-                    'fillOpacity': 0.7,
-                },
-                tooltip=GeoJsonTooltip(
-                    fields=["tractid_short", "risk_index"],
-                    aliases=["Tract ID", "Loneliness Risk Index"],
-                    localize=True
-                )
-            ).add_to(m)
+        if not np.all(np.isnan(risk)):
+            risk_key = hashlib.md5(risk.tobytes()).hexdigest()
+            deck = build_map(tract_features(gdf_tracts), risk, risk_key)
 
             st.subheader("🗺️ Loneliness Risk Index Map")
-            st_folium(m, width=1400, height=850)
+            st.pydeck_chart(deck, height=850)
 
             st.subheader("📊 Data Table")
-            display_cols = ["tractid_short"] + [col for _, col in selected_cols] + ["risk_index"]
-            st.dataframe(merged_df[[col for col in display_cols if col in merged_df.columns]])
+            table = pd.DataFrame(
+                {column_names[i]: matrix[:, i] for i in selected_idx},
+                index=pd.Index(tract_ids, name="tractid_short"),
+            )
+            table["risk_index"] = risk
+            st.dataframe(table)
         else:
             st.warning("Risk index could not be calculated from selected columns.")
     else:
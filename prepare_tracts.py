@@ -0,0 +1,47 @@
+"""One-off script: build the jefferson_tracts.fgb asset used by app.py.
+
+Downloads the statewide TIGER tract shapefile, filters to Jefferson County,
+keeps only GEOID + geometry, reprojects to WGS84, and writes a FlatGeobuf
+file small enough to commit to the repo. Run it whenever the TIGER vintage
+changes:
+
+    python prepare_tracts.py
+"""
+
+import os
+import tempfile
+import zipfile
+
+import geopandas as gpd
+import requests
+import topojson as tp
+
+URL = "https://www2.census.gov/geo/tiger/TIGER2022/TRACT/tl_2022_21_tract.zip"
+OUTPUT = "jefferson_tracts.fgb"
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        zip_path = os.path.join(tmpdir, "tracts.zip")
+        response = requests.get(URL, timeout=30)
+        response.raise_for_status()
+        with open(zip_path, "wb") as f:
+            f.write(response.content)
+
+        shp_path = None
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            zip_ref.extractall(tmpdir)
+            for f in zip_ref.namelist():
+                if f.endswith(".shp"):
+                    shp_path = os.path.join(tmpdir, f)
+
+        gdf = gpd.read_file(shp_path)
+        gdf = gdf[gdf["COUNTYFP"] == "111"]  # Jefferson County
+        gdf = gdf[["GEOID", "geometry"]].to_crs(epsg=4326)
+        # Topology-aware simplify keeps shared tract borders gap-free;
+        # ~50m tolerance is invisible at zoom 11.
+        gdf = tp.Topology(gdf, prequantize=True).toposimplify(0.0005).to_gdf(crs=gdf.crs)
+        gdf.to_file(OUTPUT, driver="FlatGeobuf")
+        print(f"Wrote {len(gdf)} tracts to {OUTPUT}")
+
+if __name__ == "__main__":
+    main()